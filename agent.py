@@ -1,40 +1,81 @@
-from langchain_anthropic import ChatAnthropic
-from langchain.agents import initialize_agent, AgentType
+from langchain.agents import AgentExecutor, ZeroShotAgent
 from langchain.agents import Tool
+from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS, PREFIX
+from langchain.chains import LLMChain
 from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, HumanMessagePromptTemplate
 from memory import get_memory
 import os
 from dotenv import load_dotenv
 
 from tools.plot_tool import dynamic_python_tool
 from tools.insight_tool import insight_tool
+from tools.stats_tool import stats_tool
 from data_loader import load_snapshots
+from llm_gateway import get_gateway
+from prompts import PromptTemplates
 
 load_dotenv()
 
-# Load LLM (Claude)
-llm = ChatAnthropic(
-    model="claude-3-5-sonnet-20241022",
-    temperature=0.3,
-    max_tokens=4096,  # Increased for longer responses
-    anthropic_api_key=os.getenv("ANTHROPIC_API_KEY")
-)
+MODEL_SETTINGS = {
+    "model": "claude-3-5-sonnet-20241022",
+    "temperature": 0.3,
+    "max_tokens": 4096,  # Increased for longer responses
+}
 
-# Add memory
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+# Load LLM (Claude) through the shared gateway, like the tools; with
+# LLM_BACKEND=stub it answers locally
+llm = get_gateway().chat_model("anthropic", **MODEL_SETTINGS)
 
 # Assemble tools
 tools = [
     dynamic_python_tool,  # For visualizations
-    insight_tool          # For Gemini vision insights
+    insight_tool,         # For Gemini vision insights
+    stats_tool            # For cached statistical summaries
 ]
 
-# Initialize agent
-agent = initialize_agent(
-    tools=tools,
-    llm=llm,
-    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    memory=memory,
-    verbose=True,
-    handle_parsing_errors=True
-)
+def build_agent_prompt(df=None):
+    """Build the ReAct prompt as a cacheable static prefix plus a small suffix.
+
+    Instructions, tool descriptions and the dataset schema go into one
+    system block marked for Anthropic prompt caching; only the question and
+    the scratchpad change from turn to turn.
+    """
+    df = load_snapshots() if df is None else df
+    static_prefix = "\n\n".join([
+        PromptTemplates.get_system_message(**MODEL_SETTINGS),
+        PromptTemplates.get_dataset_schema(df),
+        PREFIX,
+        "\n".join(f"{tool.name}: {tool.description}" for tool in tools),
+        FORMAT_INSTRUCTIONS.format(tool_names=", ".join(tool.name for tool in tools)),
+    ])
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=[
+            {"type": "text", "text": static_prefix, "cache_control": {"type": "ephemeral"}}
+        ]),
+        HumanMessagePromptTemplate.from_template("Question: {input}\nThought:{agent_scratchpad}"),
+    ])
+
+agent_prompt = build_agent_prompt()
+
+def build_agent(verbose=True):
+    """Create an agent with its own conversation memory.
+
+    The LLM, prompt and tools are shared; only the chat history is per agent,
+    so independent sessions (e.g. batch workers) don't see each other's turns.
+    """
+    react_agent = ZeroShotAgent(
+        llm_chain=LLMChain(llm=llm, prompt=agent_prompt),
+        allowed_tools=[tool.name for tool in tools]
+    )
+    return AgentExecutor.from_agent_and_tools(
+        agent=react_agent,
+        tools=tools,
+        memory=get_memory(),
+        verbose=verbose,
+        handle_parsing_errors=True
+    )
+
+# Default interactive agent
+agent = build_agent()
@@ -0,0 +1,175 @@
+"""Headless batch mode: run a file of questions and write a single report.
+
+Usage:
+    python batch.py questions.txt --out reports/nightly --workers 4 --format html
+
+The questions file holds one question per line; blank lines and lines
+starting with ``#`` are ignored.
+"""
+
+import argparse
+import html
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+from agent import build_agent
+from llm_gateway import get_gateway
+from tools.plot_tool import clear_last_figure, close_figure, get_last_figure
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchResult:
+    index: int
+    question: str
+    answer: str = ""
+    chart: Optional[str] = None
+    error: Optional[str] = None
+    seconds: float = 0.0
+
+
+def read_questions(path: str) -> List[str]:
+    """Read questions from a text file, skipping blanks and comments."""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def run_question(index: int, question: str, out_dir: str) -> BatchResult:
+    """Answer one question with a fresh agent and save its chart, if any."""
+    result = BatchResult(index=index, question=question)
+    clear_last_figure()
+    start = time.perf_counter()
+    try:
+        result.answer = str(build_agent(verbose=False).run(question))
+    except Exception as e:
+        logger.error(f"Question {index} failed: {str(e)}")
+        result.error = str(e)
+    result.seconds = time.perf_counter() - start
+
+    figure = get_last_figure()
+    if figure is not None:
+        result.chart = f"q{index:03d}.png"
+        close_figure(figure, os.path.join(out_dir, result.chart))
+        clear_last_figure()
+    return result
+
+
+def run_batch(questions: List[str], out_dir: str, workers: int = 4) -> dict:
+    """Run all questions with at most ``workers`` in flight.
+
+    Returns a dict with the ordered results and a throughput summary.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(run_question, i, q, out_dir)
+            for i, q in enumerate(questions, start=1)
+        ]
+        results = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+
+    durations = sorted(r.seconds for r in results)
+    summary = {
+        "questions": len(results),
+        "failed": sum(1 for r in results if r.error),
+        "charts": sum(1 for r in results if r.chart),
+        "workers": workers,
+        "wall_seconds": wall,
+        "serial_seconds": sum(durations),
+        "questions_per_minute": len(results) / wall * 60 if wall else 0.0,
+        "p50_seconds": _percentile(durations, 0.5),
+        "p95_seconds": _percentile(durations, 0.95),
+        "llm_usage": get_gateway().usage_summary(),
+    }
+    return {"results": results, "summary": summary}
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _summary_lines(summary: dict) -> List[str]:
+    return [
+        f"Questions: {summary['questions']} ({summary['failed']} failed, {summary['charts']} charts)",
+        f"Workers: {summary['workers']}",
+        f"Wall time: {summary['wall_seconds']:.1f}s (serial agent time {summary['serial_seconds']:.1f}s)",
+        f"Throughput: {summary['questions_per_minute']:.1f} questions/min",
+        f"Latency: p50 {summary['p50_seconds']:.1f}s, p95 {summary['p95_seconds']:.1f}s",
+        f"LLM usage: {summary['llm_usage']}",
+    ]
+
+
+def write_markdown_report(report: dict, out_dir: str) -> str:
+    lines = ["# InsightBot batch report", "", f"Generated {datetime.now():%Y-%m-%d %H:%M}", ""]
+    lines += [f"- {line}" for line in _summary_lines(report["summary"])]
+    for r in report["results"]:
+        lines += ["", f"## {r.index}. {r.question}", "", f"_{r.seconds:.1f}s_", ""]
+        lines.append(f"**Error:** {r.error}" if r.error else r.answer)
+        if r.chart:
+            lines += ["", f"![{r.question}]({r.chart})"]
+
+    path = os.path.join(out_dir, "report.md")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def write_html_report(report: dict, out_dir: str) -> str:
+    parts = [
+        "<!DOCTYPE html>",
+        "<html><head><meta charset='utf-8'><title>InsightBot batch report</title></head><body>",
+        "<h1>InsightBot batch report</h1>",
+        f"<p>Generated {datetime.now():%Y-%m-%d %H:%M}</p>",
+        "<ul>",
+    ]
+    parts += [f"<li>{html.escape(line)}</li>" for line in _summary_lines(report["summary"])]
+    parts.append("</ul>")
+    for r in report["results"]:
+        parts.append(f"<h2>{r.index}. {html.escape(r.question)}</h2>")
+        parts.append(f"<p><em>{r.seconds:.1f}s</em></p>")
+        if r.error:
+            parts.append(f"<p><strong>Error:</strong> {html.escape(r.error)}</p>")
+        else:
+            parts.append(f"<pre style='white-space: pre-wrap'>{html.escape(r.answer)}</pre>")
+        if r.chart:
+            parts.append(f"<img src='{r.chart}' alt='{html.escape(r.question)}' style='max-width: 100%'>")
+    parts.append("</body></html>")
+
+    path = os.path.join(out_dir, "report.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts) + "\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run InsightBot over a file of questions.")
+    parser.add_argument("questions", help="Text file with one question per line")
+    parser.add_argument("--out", default="reports", help="Directory for the report and charts")
+    parser.add_argument("--workers", type=int, default=4, help="Questions to run concurrently")
+    parser.add_argument("--format", choices=["html", "md"], default="html", help="Report format")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    questions = read_questions(args.questions)
+    report = run_batch(questions, args.out, workers=args.workers)
+    writer = write_html_report if args.format == "html" else write_markdown_report
+    path = writer(report, args.out)
+
+    for line in _summary_lines(report["summary"]):
+        print(line)
+    print(f"Report written to {path}")
+
+
+if __name__ == "__main__":
+    main()
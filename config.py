@@ -14,8 +14,10 @@ class Config:
     DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "t")
     
     # LLM Configuration
+    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-3.5-turbo")
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "")
+    DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "claude-3-5-sonnet-20241022")
     TEMPERATURE = float(os.getenv("TEMPERATURE", "0.0"))
     MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2000"))
     
@@ -23,6 +25,11 @@ class Config:
     DATA_DIR = os.getenv("DATA_DIR", "data")
     DEFAULT_DATASET = os.getenv("DEFAULT_DATASET", "snapshots_2000.csv")
     
+    # Approximate statistics for large tables (see tools/approx_stats.py)
+    APPROX_STATS = os.getenv("APPROX_STATS", "False").lower() in ("true", "1", "t")
+    APPROX_MIN_ROWS = int(os.getenv("APPROX_MIN_ROWS", "1000000"))
+    APPROX_SAMPLE_ROWS = int(os.getenv("APPROX_SAMPLE_ROWS", "20000"))
+    
     # Memory settings
     MEMORY_WINDOW_SIZE = int(os.getenv("MEMORY_WINDOW_SIZE", "5"))
     
@@ -33,8 +40,8 @@ class Config:
     @classmethod
     def validate(cls) -> bool:
         """Validate required configuration."""
-        if not cls.OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        if not cls.ANTHROPIC_API_KEY and cls.LLM_BACKEND.lower() != "stub":
+            raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
         return True
     
     @classmethod
@@ -49,6 +56,9 @@ class Config:
             "data_dir": cls.DATA_DIR,
             "default_dataset": cls.DEFAULT_DATASET,
             "memory_window_size": cls.MEMORY_WINDOW_SIZE,
+            "approx_stats": cls.APPROX_STATS,
+            "approx_min_rows": cls.APPROX_MIN_ROWS,
+            "approx_sample_rows": cls.APPROX_SAMPLE_ROWS,
             "log_level": cls.LOG_LEVEL
         }
 
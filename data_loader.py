@@ -1,6 +1,40 @@
 import pandas as pd
+from functools import lru_cache
 
-def load_snapshots(path='snapshots_2000.csv'):
+
+@lru_cache(maxsize=4)
+def _read_snapshots(path):
     df = pd.read_csv(path)
     df = df[df['days_since_last_event'].notna()]
     return df
+
+
+def load_snapshots(path='snapshots_2000.csv'):
+    # The parsed CSV is shared across tools, sessions and batch workers;
+    # hand out a copy so generated code can't mutate the cached frame.
+    return _read_snapshots(path).copy()
+
+
+class SnapshotLoader:
+    """SQL access to the snapshots; the data is exposed as the view `dataset`.
+
+    The view reads the CSV in DuckDB, so queries such as counts and samples
+    only return their result rows instead of loading the table into pandas.
+    """
+
+    def __init__(self, path='snapshots_2000.csv'):
+        self.path = path
+
+    def query(self, sql):
+        import duckdb
+
+        con = duckdb.connect()
+        try:
+            path = self.path.replace("'", "''")
+            con.execute(
+                "CREATE VIEW dataset AS SELECT * FROM read_csv_auto('" + path + "') "
+                "WHERE days_since_last_event IS NOT NULL"
+            )
+            return con.execute(sql).df()
+        finally:
+            con.close()
@@ -0,0 +1,479 @@
+"""Shared gateway for all LLM calls (Anthropic, Gemini, or a local stub).
+
+Every tool sends requests through :func:`get_gateway`, which provides:
+
+- one pooled client per provider, created on first use
+- single-flight coalescing: identical requests already in flight share one
+  provider call
+- a token-bucket rate limiter per provider
+- retries with jittered exponential backoff on rate-limit and overload errors
+- accounting of cached vs uncached input tokens and time to first token,
+  to verify prompt caching
+
+Set ``LLM_BACKEND=stub`` to answer every request locally (no API keys or
+network needed).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Requests per minute allowed per provider
+DEFAULT_RPM = {"anthropic": 50, "gemini": 60, "stub": 6000}
+# Providers whose requests mark a prefix for prompt caching; only these count
+# towards the cache statistics in ``usage_summary``
+PROMPT_CACHING_PROVIDERS = {"anthropic"}
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+    "OverloadedError", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+    "TooManyRequests",
+}
+
+
+@dataclass
+class LLMResponse:
+    """Provider-independent response.
+
+    ``input_tokens`` counts only uncached prompt tokens; tokens read from or
+    written to the provider's prompt cache are counted separately.
+    ``first_token_seconds`` is the time to the first streamed output token,
+    when the backend measures it.
+    """
+    text: str
+    provider: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    first_token_seconds: Optional[float] = None
+    raw: Any = field(default=None, repr=False)
+
+
+class TokenBucket:
+    """Blocking token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens if available; otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until tokens are available; return the total time waited."""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire(tokens)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+class AnthropicBackend:
+    """Anthropic Messages API with a pooled HTTP client.
+
+    Responses are streamed so the time to the first output token, which is
+    what a prompt cache hit shortens, can be measured apart from generation.
+    """
+
+    name = "anthropic"
+
+    def __init__(self, max_connections: int = 20):
+        import httpx
+        from anthropic import Anthropic
+
+        self.client = Anthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            max_retries=0,  # retries are handled by the gateway
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+            ),
+        )
+
+    def complete(self, request: Dict[str, Any]) -> LLMResponse:
+        start = time.perf_counter()
+        first_token = None
+        with self.client.messages.stream(**request) as stream:
+            for _ in stream.text_stream:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+            message = stream.get_final_message()
+        usage = getattr(message, "usage", None)
+        return LLMResponse(
+            text="".join(getattr(block, "text", "") for block in message.content),
+            provider=self.name,
+            model=request.get("model", ""),
+            input_tokens=getattr(usage, "input_tokens", 0) or 0,
+            output_tokens=getattr(usage, "output_tokens", 0) or 0,
+            cache_read_tokens=getattr(usage, "cache_read_input_tokens", 0) or 0,
+            cache_write_tokens=getattr(usage, "cache_creation_input_tokens", 0) or 0,
+            first_token_seconds=first_token,
+            raw=message,
+        )
+
+
+class GeminiBackend:
+    """Google Gemini; model objects are cached per model name.
+
+    No prompt caching: the configured model does not cache prompt prefixes,
+    so every call is billed and timed as uncached input.
+    """
+
+    name = "gemini"
+
+    def __init__(self):
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        self._genai = genai
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, name: str):
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self._genai.GenerativeModel(name)
+            return self._models[name]
+
+    def complete(self, request: Dict[str, Any]) -> LLMResponse:
+        response = self._model(request["model"]).generate_content(request["contents"])
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text,
+            provider=self.name,
+            model=request["model"],
+            input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            raw=response,
+        )
+
+
+def _stub_reply(request: Dict[str, Any]) -> str:
+    prompt = json.dumps(request, default=str)
+    if "fig = plt.figure" in prompt:
+        # Valid plotting code so the chart pipeline can run end to end
+        return ("fig = plt.figure(figsize=(10,6))\n"
+                "df.select_dtypes('number').iloc[:, 0].hist(bins=30)")
+    if "Final Answer:" in prompt and request.get("messages"):
+        # ReAct agent turn: call the first listed tool once, then answer
+        turn = str(request["messages"][-1]["content"])
+        if "Observation:" in turn:
+            observation = turn.rsplit("Observation:", 1)[1].split("\nThought:")[0].strip()
+            return f" I now know the final answer\nFinal Answer: {observation}"
+        tools = re.search(r"should be one of \[([^\],]+)", prompt)
+        question = turn.split("Question:", 1)[-1].split("\nThought:")[0].strip()
+        if tools:
+            return f" I'll use a tool.\nAction: {tools.group(1).strip()}\nAction Input: {question}"
+        return f" I now know the final answer\nFinal Answer: Stub answer to: {question}"
+    return f"Stub response ({len(prompt)} prompt characters)."
+
+
+class StubBackend:
+    """Local backend for tests and offline runs.
+
+    ``handler`` maps the provider-native request dict to the reply text;
+    ``latency`` simulates the time to first token. Calls are recorded in
+    ``requests``. Token usage is estimated at four characters per token, and
+    a ``system`` prefix marked with ``cache_control`` is reported as a cache
+    write the first time and a cache read afterwards.
+    """
+
+    name = "stub"
+
+    def __init__(self, handler: Optional[Callable[[Dict[str, Any]], str]] = None,
+                 latency: float = 0.0):
+        self.handler = handler or _stub_reply
+        self.latency = latency
+        self.requests = []
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+    def complete(self, request: Dict[str, Any]) -> LLMResponse:
+        prefix = json.dumps(request.get("system", ""), sort_keys=True, default=str)
+        prefix_tokens = len(prefix) // 4
+        cacheable = "cache_control" in prefix
+        with self._lock:
+            self.requests.append(request)
+            hit = prefix in self._prefixes
+            if cacheable:
+                self._prefixes.add(prefix)
+        first_token = self.latency / 2 if hit else self.latency
+        if first_token:
+            time.sleep(first_token)
+
+        rest_tokens = len(json.dumps(request.get("messages", request.get("contents", "")), default=str)) // 4
+        return LLMResponse(
+            text=self.handler(request),
+            provider=self.name,
+            model=request.get("model", "stub"),
+            input_tokens=rest_tokens + (0 if cacheable else prefix_tokens),
+            cache_read_tokens=prefix_tokens if hit else 0,
+            cache_write_tokens=prefix_tokens if cacheable and not hit else 0,
+            first_token_seconds=first_token,
+        )
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS:
+        return True
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_key(provider: str, request: Dict[str, Any]) -> str:
+    def encode(value):
+        # Images (e.g. PIL) are keyed by their pixel data
+        if hasattr(value, "tobytes"):
+            return hashlib.sha256(value.tobytes()).hexdigest()
+        return repr(value)
+
+    payload = json.dumps([provider, request], sort_keys=True, default=encode)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    """Routes requests to provider backends with coalescing, rate limits and retries."""
+
+    def __init__(self, backends: Optional[Dict[str, Any]] = None,
+                 rpm: Optional[Dict[str, float]] = None, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self._backends = dict(backends or {})
+        self._rpm = dict(rpm or {})
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "provider_calls": 0, "coalesced": 0,
+                      "retries": 0, "errors": 0, "rate_limit_wait_seconds": 0.0,
+                      "input_tokens": 0, "output_tokens": 0,
+                      "cache_read_tokens": 0, "cache_write_tokens": 0,
+                      "cache_hit_calls": 0, "cache_hit_timed_calls": 0,
+                      "cache_hit_first_token_seconds": 0.0,
+                      "cache_miss_calls": 0, "cache_miss_timed_calls": 0,
+                      "cache_miss_first_token_seconds": 0.0,
+                      "uncached_provider_input_tokens": 0}
+
+    def backend(self, provider: str):
+        with self._lock:
+            if provider not in self._backends:
+                if os.getenv("LLM_BACKEND", "").lower() == "stub":
+                    self._backends[provider] = StubBackend()
+                elif provider == "anthropic":
+                    self._backends[provider] = AnthropicBackend(
+                        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")))
+                elif provider == "gemini":
+                    self._backends[provider] = GeminiBackend()
+                else:
+                    raise ValueError(f"Unknown LLM provider: {provider}")
+            return self._backends[provider]
+
+    def bucket(self, provider: str) -> TokenBucket:
+        with self._lock:
+            if provider not in self._buckets:
+                # An explicit ``rpm`` argument wins over the environment
+                rpm = self._rpm.get(provider)
+                if rpm is None:
+                    rpm = float(os.getenv(f"{provider.upper()}_RPM", DEFAULT_RPM.get(provider, 60)))
+                self._buckets[provider] = TokenBucket(rate=rpm / 60.0, capacity=max(1.0, rpm / 10))
+            return self._buckets[provider]
+
+    def _count(self, stat: str, amount=1) -> None:
+        with self._lock:
+            self.stats[stat] += amount
+
+    def record_usage(self, provider: str, input_tokens: int = 0, output_tokens: int = 0,
+                     cache_read_tokens: int = 0, cache_write_tokens: int = 0,
+                     first_token_seconds: Optional[float] = None) -> None:
+        """Add one provider call's token usage and time to first token to ``stats``.
+
+        Cache hit/miss counts and timings only cover providers in
+        ``PROMPT_CACHING_PROVIDERS``.
+        """
+        with self._lock:
+            self.stats["input_tokens"] += input_tokens
+            self.stats["output_tokens"] += output_tokens
+            if provider not in PROMPT_CACHING_PROVIDERS:
+                self.stats["uncached_provider_input_tokens"] += input_tokens
+                return
+            outcome = "cache_hit" if cache_read_tokens else "cache_miss"
+            self.stats["cache_read_tokens"] += cache_read_tokens
+            self.stats["cache_write_tokens"] += cache_write_tokens
+            self.stats[f"{outcome}_calls"] += 1
+            if first_token_seconds is not None:
+                self.stats[f"{outcome}_timed_calls"] += 1
+                self.stats[f"{outcome}_first_token_seconds"] += first_token_seconds
+
+    def usage_summary(self) -> str:
+        """One-line summary of prompt cache effectiveness (Anthropic calls only)."""
+        with self._lock:
+            stats = dict(self.stats)
+        uncached = stats["uncached_provider_input_tokens"]
+        prompt_tokens = (stats["input_tokens"] - uncached
+                         + stats["cache_read_tokens"] + stats["cache_write_tokens"])
+        cached_share = stats["cache_read_tokens"] / prompt_tokens if prompt_tokens else 0.0
+        timings = {}
+        for outcome in ("cache_hit", "cache_miss"):
+            calls = stats[f"{outcome}_timed_calls"]
+            timings[outcome] = stats[f"{outcome}_first_token_seconds"] / calls if calls else 0.0
+        return (f"Anthropic: {prompt_tokens:,} prompt tokens, {cached_share:.0%} read from cache "
+                f"({stats['cache_write_tokens']:,} written); mean time to first token "
+                f"{timings['cache_hit']:.2f}s with cache hit, {timings['cache_miss']:.2f}s without. "
+                f"Gemini (no prompt caching): {uncached:,} prompt tokens")
+
+    def complete(self, provider: str, **request) -> LLMResponse:
+        """Send a provider-native request (e.g. ``messages.create`` kwargs for Anthropic).
+
+        Identical requests issued while one is in flight wait for and share
+        its response.
+        """
+        key = _request_key(provider, request)
+        with self._lock:
+            self.stats["requests"] += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._call_with_retries(provider, request))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+        return future.result()
+
+    def _call_with_retries(self, provider: str, request: Dict[str, Any]) -> LLMResponse:
+        backend = self.backend(provider)
+        bucket = self.bucket(provider)
+        attempt = 0
+        while True:
+            self._count("rate_limit_wait_seconds", bucket.acquire())
+            self._count("provider_calls")
+            try:
+                response = backend.complete(request)
+                self.record_usage(provider, response.input_tokens, response.output_tokens,
+                                  response.cache_read_tokens, response.cache_write_tokens,
+                                  response.first_token_seconds)
+                return response
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self._count("errors")
+                    raise
+                # Full jitter, but never sooner than the provider asked for
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0.0)
+                logger.warning(f"{provider} request failed ({type(e).__name__}); "
+                               f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                self._count("retries")
+                attempt += 1
+                time.sleep(delay)
+
+    def chat_model(self, provider: str, **settings):
+        """LangChain chat model that sends its calls through this gateway.
+
+        ``settings`` are provider-native request fields (e.g. model,
+        temperature, max_tokens). System message content blocks, including
+        ``cache_control`` markers, are passed through unchanged, so agent
+        turns get the same coalescing, rate limits, retries and usage
+        accounting as the tools.
+        """
+        from langchain_core.language_models.chat_models import BaseChatModel
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration, ChatResult
+
+        gateway = self
+
+        class _GatewayChatModel(BaseChatModel):
+            @property
+            def _llm_type(self) -> str:
+                return f"gateway-{provider}"
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                system = []
+                chat = []
+                for message in messages:
+                    if message.type == "system":
+                        content = message.content
+                        system += content if isinstance(content, list) else [{"type": "text", "text": content}]
+                    else:
+                        role = "assistant" if message.type == "ai" else "user"
+                        chat.append({"role": role, "content": message.content})
+                request = dict(settings, messages=chat)
+                if system:
+                    request["system"] = system
+                if stop:
+                    request["stop_sequences"] = list(stop)
+                text = gateway.complete(provider, **request).text
+                for sequence in stop or []:
+                    text = text.split(sequence)[0]
+                return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+        return _GatewayChatModel()
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Return the process-wide gateway."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway(max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")))
+        return _gateway
+
+
+def set_gateway(gateway: LLMGateway) -> None:
+    """Replace the process-wide gateway (e.g. with a stub-backed one in tests)."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
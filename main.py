@@ -1,11 +1,15 @@
 from agent import agent
+from prefetch import get_prefetcher
 
 def run_bot():
+    prefetcher = get_prefetcher()
     while True:
         query = input("\n🤖 Ask InsightBot: ")
         if query.lower() in ["exit", "quit"]:
             break
-        response = agent.run(query)
+        with prefetcher.foreground():
+            response = agent.run(query)
+        prefetcher.on_answer(query, response)
         print(f"🔍 InsightBot: {response}")
 
 run_bot()
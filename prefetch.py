@@ -0,0 +1,237 @@
+"""Speculative background precomputation of likely next questions.
+
+A low-priority worker thread reads the dataset and fills the caches with
+the questions users almost always ask first: overview, missing values,
+correlations with ``label``, group means, and the charts predicted by
+``PromptTemplates.suggest_visualizations`` plus distributions of the
+features most correlated with ``label``. After each answer it queues
+follow-ups about the columns the question mentioned.
+
+Prefetched charts warm the generated-code cache in ``tools.plot_tool``,
+which is keyed by the normalized request text, so only a request worded
+like the prefetched one (ignoring case and spacing) reuses the code.
+
+Prefetching gives way to real requests: wrap them in
+``prefetcher.foreground()`` to pause the worker and drop its pending tasks.
+A task that is already running finishes (its LLM call is shared with an
+identical real request by the gateway's coalescing).
+
+Set ``PREFETCH=0`` to disable, and ``PREFETCH_MAX_CHARTS`` to cap the chart
+generation (LLM) calls queued at a time.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from data_loader import load_snapshots
+from prompts import PromptTemplates
+from tools.plot_tool import clear_last_figure, generate_and_run_code, get_last_figure
+from tools.stats_tool import StatsTool, dataset_stats
+
+logger = logging.getLogger(__name__)
+
+# Task priorities (lower runs first)
+LOAD, STATS, CHART, DEFERRED_STATS, DEFERRED_CHART = range(5)
+
+# Reads the dataset and plans the load-time tasks, on the worker thread
+LOAD_TASK = ("load", "dataset")
+
+
+class Prefetcher:
+    """Background worker that precomputes stats and charts into the tool caches."""
+
+    def __init__(self, stats: StatsTool = dataset_stats, target: str = "label",
+                 top_features: int = 3, max_charts: int = 6, pause_seconds: float = 0.2,
+                 niceness: int = 10, enabled: bool = True):
+        self.stats = stats
+        self.target = target
+        self.top_features = top_features
+        self.max_charts = max_charts
+        self.pause_seconds = pause_seconds
+        self.niceness = niceness
+        self.enabled = enabled
+
+        self._df: Optional[pd.DataFrame] = None
+        self._load: Callable[[], pd.DataFrame] = load_snapshots
+        self._tasks = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._foreground = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopped = threading.Event()
+        self._pending = set()
+        self._running: Optional[Tuple[str, str]] = None
+        self._completed = set()
+        self._load_tasks: List[Tuple[str, str]] = []
+
+        if enabled:
+            self._thread = threading.Thread(target=self._work, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def on_dataset_loaded(self, load: Callable[[], pd.DataFrame] = load_snapshots) -> None:
+        """Queue the usual first questions for a freshly loaded dataset.
+
+        Reading the data and picking the questions (which scans the whole
+        frame) happen on the worker thread, so the caller returns at once.
+        """
+        self._load = load
+        self._schedule([LOAD_TASK], LOAD, LOAD)
+
+    def _plan(self) -> None:
+        df = self._load()
+        numeric_cols = list(df.select_dtypes(include=[np.number]).columns)
+        categorical_cols = list(df.select_dtypes(include=["object", "category"]).columns)
+        date_cols = list(df.select_dtypes(include=["datetime64"]).columns)
+
+        stats_queries = ["overview", "missing values", "correlation", "describe"]
+        charts = []
+        if self.target in numeric_cols:
+            stats_queries += [f"correlation with {self.target}", f"mean by {self.target}"]
+            charts += [f"Distribution of {col} by {self.target}"
+                       for col in self._top_features(df, numeric_cols)]
+        charts += PromptTemplates.suggest_visualizations(numeric_cols, categorical_cols, date_cols)
+
+        self._df = df
+        self._load_tasks = [("stats", q) for q in stats_queries] + [("chart", q) for q in charts]
+        self._schedule(self._load_tasks, STATS, CHART)
+
+    def on_answer(self, query: str, answer: str = "") -> None:
+        """Queue follow-ups for the columns a just-answered question mentioned.
+
+        Load-time tasks dropped by earlier real requests are re-queued behind
+        the follow-ups.
+        """
+        if self._df is None:
+            # The dataset hasn't been read yet (or a real request cancelled that)
+            self._schedule([LOAD_TASK], LOAD, LOAD)
+            return
+        query = query.lower()
+        mentioned = [col for col in self._df.columns
+                     if str(col).lower() in query and col != self.target][:2]
+        numeric_cols = set(self._df.select_dtypes(include=[np.number]).columns)
+
+        follow_ups = []
+        for col in mentioned:
+            if col in numeric_cols:
+                follow_ups += [("stats", f"correlation with {col}"),
+                               ("chart", f"Distribution of {col} by {self.target}")]
+            else:
+                follow_ups += [("stats", f"mean by {col}"), ("chart", f"Bar chart of {col}")]
+        self._schedule(follow_ups, STATS, CHART)
+        self._schedule(self._load_tasks, DEFERRED_STATS, DEFERRED_CHART)
+
+    @contextmanager
+    def foreground(self):
+        """Pause prefetching and drop pending tasks while a real request runs."""
+        with self._lock:
+            self._foreground += 1
+            self._generation += 1
+            self._pending.clear()
+            self._idle.clear()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                if not self._foreground:
+                    self._idle.set()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._idle.set()
+
+    def _top_features(self, df: pd.DataFrame, numeric_cols: List[str]) -> List[str]:
+        corr = df[numeric_cols].corrwith(df[self.target]).drop(self.target).abs().dropna()
+        return list(corr.nlargest(self.top_features).index)
+
+    def _schedule(self, tasks: List[Tuple[str, str]], stats_priority: int,
+                  chart_priority: int) -> None:
+        if not self.enabled:
+            return
+        charts = 0
+        with self._lock:
+            for task in tasks:
+                if task in self._completed or task in self._pending or task == self._running:
+                    continue
+                if task[0] == "chart":
+                    if charts >= self.max_charts:
+                        continue
+                    charts += 1
+                priority = chart_priority if task[0] == "chart" else stats_priority
+                self._pending.add(task)
+                self._tasks.put((priority, next(self._order), self._generation, task))
+
+    def _lower_priority(self) -> None:
+        try:
+            # On Linux this renices only the calling thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.niceness)
+        except (AttributeError, OSError):
+            pass  # Not supported on this platform; the pause between tasks still applies
+
+    def _work(self) -> None:
+        self._lower_priority()
+        while not self._stopped.is_set():
+            try:
+                _, _, generation, task = self._tasks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._idle.wait()
+            with self._lock:
+                if generation != self._generation or self._stopped.is_set():
+                    continue  # Cancelled by a real request
+                # foreground() clears _pending, so the running task is tracked separately
+                self._running = task
+            try:
+                self._run(*task)
+            except Exception as e:
+                logger.warning(f"Prefetch of {task} failed: {str(e)}")
+            with self._lock:
+                self._running = None
+                self._pending.discard(task)
+                self._completed.add(task)
+            time.sleep(self.pause_seconds)
+
+    def _run(self, kind: str, query: str) -> None:
+        start = time.perf_counter()
+        if kind == "load":
+            self._plan()
+        elif kind == "stats":
+            self.stats.run(query)
+        else:
+            # Warms the generated-code cache; the figure itself is discarded.
+            # Generated code runs on its own copy, never the shared DataFrame
+            generate_and_run_code(query, load_snapshots())
+            figure = get_last_figure()
+            if figure is not None:
+                plt.close(figure)
+            clear_last_figure()
+        logger.debug(f"Prefetched {kind} '{query}' in {time.perf_counter() - start:.2f}s")
+
+
+_prefetcher: Optional[Prefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Return the process-wide prefetcher, starting it on first use."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(
+                max_charts=int(os.getenv("PREFETCH_MAX_CHARTS", "6")),
+                enabled=os.getenv("PREFETCH", "1").lower() not in ("0", "false", "no"),
+            )
+            _prefetcher.on_dataset_loaded()
+        return _prefetcher
@@ -1,4 +1,5 @@
 from typing import Dict, Any, List, Optional
+import pandas as pd
 from langchain.prompts import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
@@ -31,15 +32,60 @@ class PromptTemplates:
     - Max tokens: {max_tokens}
     """
     
-    # Default chat prompt
+    # Chart code generation instructions (static, so they belong in the cached prefix)
+    CODEGEN_INSTRUCTIONS = """
+    You are a Python data analyst. You will be given a user's request about the
+    DataFrame `df` described below.
+    
+    Write Python code (only code, no explanation) that:
+    - Uses pandas, seaborn, or matplotlib
+    - Assumes df is already loaded
+    - Always begins with: fig = plt.figure(figsize=(10,6))
+    - Draws plots into that figure
+    - Ends with: return fig (do NOT use plt.show())
+    - Handles missing values and categorical axes if needed
+    - Do NOT include any explanation or markdown formatting. Only return raw, executable Python code. No text before or after.
+    """
+    
+    # Dataset description shared by every prompt about the same DataFrame
+    DATASET_SCHEMA = """
+    Dataset `df`: {num_rows} rows x {num_columns} columns
+    
+    Columns:
+    {columns}
+    
+    Here is the first 3 rows of the DataFrame `df`:
+    {sample_rows}
+    """
+    
     @classmethod
-    def get_chat_prompt(cls, **kwargs) -> ChatPromptTemplate:
-        """Get the default chat prompt template."""
-        system_template = cls.SYSTEM_MESSAGE.format(
+    def get_system_message(cls, **kwargs) -> str:
+        """Get the system message filled in with the model settings."""
+        return cls.SYSTEM_MESSAGE.format(
             model=kwargs.get("model", Config.DEFAULT_MODEL),
             temperature=kwargs.get("temperature", Config.TEMPERATURE),
             max_tokens=kwargs.get("max_tokens", Config.MAX_TOKENS)
         )
+    
+    @classmethod
+    def get_dataset_schema(cls, df: pd.DataFrame) -> str:
+        """Describe a DataFrame's shape, column types and first rows.
+        
+        The output only depends on the data, so it is byte-identical across
+        calls and can be cached by the provider as part of a prompt prefix.
+        """
+        return cls.DATASET_SCHEMA.format(
+            num_rows=len(df),
+            num_columns=len(df.columns),
+            columns="\n    ".join(f"- {col} ({dtype})" for col, dtype in df.dtypes.items()),
+            sample_rows=df.head(3).to_string()
+        )
+    
+    # Default chat prompt
+    @classmethod
+    def get_chat_prompt(cls, **kwargs) -> ChatPromptTemplate:
+        """Get the default chat prompt template."""
+        system_template = cls.get_system_message(**kwargs)
         
         system_message_prompt = SystemMessagePromptTemplate.from_template(system_template)
         human_message_prompt = HumanMessagePromptTemplate.from_template("{input}")
@@ -125,13 +171,13 @@ class PromptTemplates:
         )
     
     @classmethod
-    def get_visualization_suggestions(
-        cls, 
-        numeric_cols: List[str], 
+    def suggest_visualizations(
+        cls,
+        numeric_cols: List[str],
         categorical_cols: List[str],
         date_cols: List[str]
-    ) -> str:
-        """Get suggestions for visualizations based on column types."""
+    ) -> List[str]:
+        """List likely visualizations (at least three) based on column types."""
         suggestions = []
         
         # Generate suggestions based on available columns
@@ -157,6 +203,18 @@ class PromptTemplates:
         while len(suggestions) < 3:
             suggestions.append("Pair plot of numeric columns")
         
+        return suggestions
+    
+    @classmethod
+    def get_visualization_suggestions(
+        cls, 
+        numeric_cols: List[str], 
+        categorical_cols: List[str],
+        date_cols: List[str]
+    ) -> str:
+        """Get suggestions for visualizations based on column types."""
+        suggestions = cls.suggest_visualizations(numeric_cols, categorical_cols, date_cols)
+        
         return cls.VISUALIZATION_SUGGESTION.format(
             numeric_columns=", ".join(numeric_cols) if numeric_cols else "None",
             categorical_columns=", ".join(categorical_cols) if categorical_cols else "None",
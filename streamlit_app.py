@@ -3,10 +3,14 @@ from PIL import Image
 from agent import agent
 import matplotlib.pyplot as plt
 from tools.plot_tool import get_last_figure
+from prefetch import get_prefetcher
 
 st.set_page_config(page_title="📊 InsightBot", layout="wide")
 st.title("📊 InsightBot: Ask Data Questions")
 
+# Start precomputing likely first questions as soon as the app loads
+prefetcher = get_prefetcher()
+
 # Keep history
 if "history" not in st.session_state:
     st.session_state.history = []
@@ -17,8 +21,10 @@ if user_input:
     st.chat_message("user").write(user_input)
     with st.spinner("🤖 Thinking..."):
         try:
-            # Run agent
-            output = agent.run(user_input)
+            # Run agent (background prefetching pauses meanwhile)
+            with prefetcher.foreground():
+                output = agent.run(user_input)
+            prefetcher.on_answer(user_input, output)
             
             # Check if a figure was generated
             figure = get_last_figure()
@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import anthropic
+import httpx
+import pytest
+
+from llm_gateway import LLMGateway, StubBackend, TokenBucket
+
+REQUEST = {"model": "stub", "max_tokens": 10, "messages": [{"role": "user", "content": "hi"}]}
+
+
+def _rate_limit_error(retry_after="0"):
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return anthropic.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_identical_concurrent_requests_share_one_provider_call():
+    started = threading.Event()
+
+    def handler(request):
+        started.set()
+        time.sleep(0.3)  # keep the first call in flight while the others arrive
+        return "answer"
+
+    backend = StubBackend(handler=handler)
+    gateway = LLMGateway(backends={"anthropic": backend}, rpm={"anthropic": 6000})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        first = pool.submit(gateway.complete, "anthropic", **REQUEST)
+        started.wait(5)
+        others = [pool.submit(gateway.complete, "anthropic", **REQUEST) for _ in range(7)]
+        texts = [f.result().text for f in [first] + others]
+
+    assert texts == ["answer"] * 8
+    assert len(backend.requests) == 1
+    assert gateway.stats["provider_calls"] == 1
+    assert gateway.stats["coalesced"] == 7
+
+
+def test_rate_limit_error_is_retried():
+    calls = []
+
+    class FlakyBackend(StubBackend):
+        def complete(self, request):
+            calls.append(request)
+            if len(calls) < 3:
+                raise _rate_limit_error()
+            return super().complete(request)
+
+    gateway = LLMGateway(backends={"anthropic": FlakyBackend(handler=lambda r: "ok")},
+                         rpm={"anthropic": 6000}, base_delay=0.01, max_delay=0.02)
+
+    assert gateway.complete("anthropic", **REQUEST).text == "ok"
+    assert len(calls) == 3
+    assert gateway.stats["retries"] == 2
+    assert gateway.stats["errors"] == 0
+
+
+def test_retries_give_up_after_max_retries():
+    class AlwaysLimited(StubBackend):
+        def complete(self, request):
+            raise _rate_limit_error()
+
+    gateway = LLMGateway(backends={"anthropic": AlwaysLimited()}, rpm={"anthropic": 6000},
+                         max_retries=2, base_delay=0.01, max_delay=0.02)
+
+    with pytest.raises(anthropic.RateLimitError):
+        gateway.complete("anthropic", **REQUEST)
+    assert gateway.stats["provider_calls"] == 3
+    assert gateway.stats["errors"] == 1
+
+
+def test_token_bucket_waits_once_burst_is_spent():
+    bucket = TokenBucket(rate=20.0, capacity=2)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    start = time.perf_counter()
+    waited = bucket.acquire()
+    assert waited > 0.02
+    assert time.perf_counter() - start >= 0.04
+
+
+def test_gateway_waits_for_rate_limit(monkeypatch):
+    # Explicit rpm wins over the environment: 120 rpm is 2 requests/s, burst 12
+    monkeypatch.setenv("ANTHROPIC_RPM", "100000")
+    gateway = LLMGateway(backends={"anthropic": StubBackend()}, rpm={"anthropic": 120})
+
+    start = time.perf_counter()
+    for i in range(13):
+        gateway.complete("anthropic", **{**REQUEST, "messages": [{"role": "user", "content": str(i)}]})
+
+    assert time.perf_counter() - start >= 0.4
+    assert gateway.stats["rate_limit_wait_seconds"] > 0.3
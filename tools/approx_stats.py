@@ -0,0 +1,404 @@
+"""Approximate, progressively refined statistics for large tables.
+
+The first answer comes from a stratified sample (by ``label`` and
+``center_id`` when present) drawn in SQL, with confidence intervals. A
+background thread then loads the table and grows the sample until it covers
+all rows. Intermediate quantiles come from a KLL-style sketch fed
+incrementally as more rows are seen; the final stage covers the whole table
+and computes every statistic exactly. Distinct counts are only reported at
+that stage, since a sample's distinct count says little about the table's.
+"""
+
+import logging
+import threading
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRATA = ("label", "center_id")
+DEFAULT_SAMPLE_ROWS = 20_000
+DEFAULT_MIN_ROWS = 1_000_000  # below this, exact statistics are fast enough
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+class QuantileSketch:
+    """KLL-style quantile sketch with rank error of roughly 1.7 / k."""
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values) -> None:
+        """Add numeric values; NaNs are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                keep = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def quantile(self, qs: Sequence[float]) -> np.ndarray:
+        qs = np.clip(np.asarray(qs, dtype=np.float64), 0.0, 1.0)
+        if not self.n:
+            return np.full(len(qs), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2.0 ** h) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, qs * cumulative[-1], side="left")
+        return items[order][np.clip(idx, 0, len(items) - 1)]
+
+    @property
+    def rank_error(self) -> float:
+        return 1.7 / self.k
+
+
+class StratifiedSampler:
+    """Nested stratified samples of a DataFrame.
+
+    Rows are shuffled once; each stratum then contributes its first
+    ``ceil(N_h * n / N)`` rows (at least ``min_per_stratum``), so a larger
+    sample always contains every smaller one.
+    """
+
+    def __init__(self, df: pd.DataFrame, strata: Sequence[str] = DEFAULT_STRATA,
+                 seed: int = 0, min_per_stratum: int = 2):
+        self.population = len(df)
+        self.strata = [col for col in strata if col in df.columns]
+        self.min_per_stratum = min_per_stratum
+        order = np.random.default_rng(seed).permutation(self.population)
+        self.shuffled = df.iloc[order]
+
+        if self.strata:
+            grouped = self.shuffled.groupby(self.strata, dropna=False, sort=False)
+            self._stratum_size = grouped[self.strata[0]].transform("size").to_numpy()
+            self._rank = grouped.cumcount().to_numpy()
+        else:
+            self._stratum_size = np.full(self.population, self.population)
+            self._rank = np.arange(self.population)
+
+    def sample(self, n_rows: int):
+        """Return ``(sample, weights)`` where weights are N_h / n_h per row."""
+        if n_rows >= self.population:
+            return self.shuffled, np.ones(self.population)
+        fraction = n_rows / self.population
+        alloc = np.minimum(
+            self._stratum_size,
+            np.maximum(np.ceil(self._stratum_size * fraction), self.min_per_stratum),
+        )
+        mask = self._rank < alloc
+        return self.shuffled[mask], (self._stratum_size / alloc)[mask]
+
+
+@dataclass
+class Estimate:
+    """Statistics from one refinement stage.
+
+    ``*_err`` columns are half-widths of the confidence interval.
+    """
+    stage: int
+    rows: int
+    population: int
+    exact: bool
+    confidence: float
+    summary: pd.DataFrame
+    corr: pd.DataFrame
+    corr_low: pd.DataFrame
+    corr_high: pd.DataFrame
+    missing: pd.DataFrame
+    distinct: Optional[pd.Series]  # None until the whole table has been seen
+    sample: pd.DataFrame
+    weights: np.ndarray
+    strata: List[str]
+
+    def group_means(self, by: str) -> pd.DataFrame:
+        """Weighted mean (with CI half-width) of numeric columns per ``by`` group."""
+        numeric = [c for c in self.summary.index if c != by]
+        frame = self.sample[numeric].assign(_w=self.weights)
+        groups = frame.groupby(self.sample[by], dropna=False)
+        means, errors = {}, {}
+        for key, group in groups:
+            w = group["_w"].to_numpy()
+            values = group[numeric]
+            mask = values.notna()
+            weight_sum = (mask * w[:, None]).sum()
+            means[key] = (values.fillna(0) * w[:, None]).sum() / weight_sum
+            if self.exact:
+                errors[key] = means[key] * 0.0
+            else:
+                errors[key] = _z(self.confidence) * values.std(ddof=1) / np.sqrt(mask.sum().clip(lower=1))
+        means = pd.DataFrame(means).T
+        errors = pd.DataFrame(errors).T.add_suffix("_err").fillna(0.0)
+        return pd.concat([means, errors], axis=1)
+
+
+def _z(confidence: float) -> float:
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+def _weighted_quantiles(values: pd.Series, weights: np.ndarray, qs: Sequence[float]) -> np.ndarray:
+    """Quantiles of a weighted sample; NaNs are ignored."""
+    mask = values.notna().to_numpy()
+    x = values.to_numpy(dtype=np.float64, na_value=np.nan)[mask]
+    if not len(x):
+        return np.full(len(qs), np.nan)
+    order = np.argsort(x)
+    cumulative = np.cumsum(weights[mask][order])
+    targets = np.clip(np.asarray(qs, dtype=np.float64), 0.0, 1.0) * cumulative[-1]
+    idx = np.searchsorted(cumulative, targets, side="left")
+    return x[order][np.clip(idx, 0, len(x) - 1)]
+
+
+def stratified_sample_sql(table: str, strata: Sequence[str], population: int, n_rows: int,
+                          min_per_stratum: int = 2) -> str:
+    """SQL (DuckDB) drawing a proportional stratified sample of about ``n_rows`` rows.
+
+    Each stratum is Bernoulli-sampled at rate ``max(ceil(N_h * n / N), m) / N_h``,
+    which needs one GROUP BY and one hash join rather than a sort of the
+    table. The result has the table's columns plus ``_weight`` (N_h / n_h).
+    """
+    fraction = min(1.0, n_rows / max(population, 1))
+    if not strata:
+        return (f"SELECT *, {population / max(n_rows, 1)} AS _weight "
+                f"FROM {table} USING SAMPLE {int(n_rows)} ROWS")
+    columns = ", ".join(f'"{col}"' for col in strata)
+    join = " AND ".join(f'd."{col}" IS NOT DISTINCT FROM s."{col}"' for col in strata)
+    return f"""
+        WITH sizes AS (
+            SELECT {columns}, COUNT(*) AS _stratum_size FROM {table} GROUP BY {columns}
+        ),
+        draws AS (
+            -- Draw the random number per row before the join, so it can't be
+            -- evaluated once per stratum
+            SELECT *, random() AS _draw FROM {table}
+        ),
+        sampled AS (
+            SELECT d.*, s._stratum_size
+            FROM draws d JOIN sizes s ON {join}
+            WHERE d._draw < GREATEST(CEIL(s._stratum_size * {fraction}), {min_per_stratum})
+                            / s._stratum_size
+        )
+        SELECT * EXCLUDE (_stratum_size, _draw),
+               _stratum_size / COUNT(*) OVER (PARTITION BY {columns}) AS _weight
+        FROM sampled
+    """
+
+
+def _stratified_mean(values: pd.DataFrame, weights: np.ndarray, keys: List[pd.Series],
+                     population: int):
+    """Weighted column means and their standard errors under stratified sampling."""
+    mask = values.notna()
+    w = weights[:, None]
+    mean = (values.fillna(0) * w).sum() / (mask * w).sum()
+
+    grouped = values.assign(_w=weights).groupby(keys, dropna=False)
+    stratum_size = grouped["_w"].sum()
+    counts = grouped[list(values.columns)].count().clip(lower=1)
+    variances = grouped[list(values.columns)].var(ddof=1).fillna(0.0)
+    share = (stratum_size / population) ** 2
+    fpc = (1 - counts.div(stratum_size, axis=0)).clip(lower=0)
+    variance = (variances.mul(share, axis=0) * fpc / counts).sum()
+    return mean, np.sqrt(variance)
+
+
+class ProgressiveStats:
+    """Compute statistics on growing stratified samples in a background thread.
+
+    The first :class:`Estimate` is computed synchronously from
+    ``initial_sample`` (e.g. drawn with :func:`stratified_sample_sql`), so
+    callers get an answer without touching the full table. ``load_full`` is
+    only called from the refinement thread. ``latest`` returns the most
+    refined estimate available.
+    """
+
+    def __init__(self, initial_sample: pd.DataFrame, initial_weights: np.ndarray,
+                 population: int, load_full: Callable[[], pd.DataFrame],
+                 strata: Sequence[str] = DEFAULT_STRATA, growth: int = 10,
+                 confidence: float = 0.95, seed: int = 0):
+        self.confidence = confidence
+        self.population = population
+        self.strata = [col for col in strata if col in initial_sample.columns]
+        self.numeric_cols = list(initial_sample.select_dtypes(include=[np.number]).columns)
+        self.seed = seed
+        self.sampler: Optional[StratifiedSampler] = None
+        self._load_full = load_full
+
+        # Stage 0 is the initial sample; later stages grow it to the whole table
+        self.schedule = [len(initial_sample)]
+        rows = len(initial_sample) * growth
+        while rows < population:
+            self.schedule.append(rows)
+            rows *= growth
+        self.schedule.append(population)
+
+        self._sketches = {col: QuantileSketch(seed=seed) for col in self.numeric_cols}
+        self._min = pd.Series(np.inf, index=self.numeric_cols)
+        self._max = pd.Series(-np.inf, index=self.numeric_cols)
+        self._seen = 0
+
+        self._lock = threading.Lock()
+        self._latest: Optional[Estimate] = None
+        self._cancelled = threading.Event()
+        self.done = threading.Event()
+
+        self._publish(0, initial_sample, np.asarray(initial_weights, dtype=np.float64), exact=False)
+        self._thread = threading.Thread(target=self._refine, daemon=True)
+        self._thread.start()
+
+    @property
+    def latest(self) -> Estimate:
+        with self._lock:
+            return self._latest
+
+    def wait(self, timeout: Optional[float] = None) -> Estimate:
+        """Block until fully refined (or ``timeout``) and return the latest estimate."""
+        self.done.wait(timeout)
+        return self.latest
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def _refine(self) -> None:
+        try:
+            df = self._load_full()
+            if self._cancelled.is_set():
+                return
+            self.sampler = StratifiedSampler(df, strata=self.strata, seed=self.seed)
+            del df
+            for stage in range(1, len(self.schedule)):
+                if self._cancelled.is_set():
+                    return
+                rows = min(self.schedule[stage], self.sampler.population)
+                exact = rows >= self.sampler.population
+                sample, weights = self.sampler.sample(rows)
+                if not exact:
+                    self._feed_sketches(rows)
+                self._publish(stage, sample, weights, exact)
+                if exact:
+                    return
+        except Exception as e:
+            logger.error(f"Progressive refinement stopped: {str(e)}")
+        finally:
+            self.done.set()
+
+    def _feed_sketches(self, rows: int) -> None:
+        # The shuffled prefix is a uniform random sample, so sketches over it
+        # estimate the whole table
+        chunk = self.sampler.shuffled.iloc[self._seen:rows]
+        numeric = chunk[self.numeric_cols]
+        for col, sketch in self._sketches.items():
+            sketch.update(numeric[col].to_numpy(dtype=np.float64, na_value=np.nan))
+        self._min = np.fmin(self._min, numeric.min())
+        self._max = np.fmax(self._max, numeric.max())
+        self._seen = rows
+
+    def _quantiles(self, numeric: pd.DataFrame, weights: np.ndarray, exact: bool) -> pd.DataFrame:
+        """Quartiles and CI half-widths, from the sketches once they have data."""
+        if exact:
+            values = numeric.quantile(list(QUANTILES)).T
+            columns = {}
+            for q in QUANTILES:
+                label = f"{q:.0%}"
+                columns[label] = values[q]
+                columns[f"{label}_err"] = values[q] * 0.0
+            return pd.DataFrame(columns)
+
+        z = _z(self.confidence)
+        use_sketches = self._seen > 0
+        n = self._seen if use_sketches else len(numeric)
+        columns = {}
+        for q in QUANTILES:
+            # Rank uncertainty from sampling plus the sketch's own rank error
+            delta = z * np.sqrt(q * (1 - q) / max(n, 1))
+            if use_sketches and self._sketches:
+                delta += next(iter(self._sketches.values())).rank_error
+            values, errors = {}, {}
+            for col in self.numeric_cols:
+                if use_sketches:
+                    low, mid, high = self._sketches[col].quantile([q - delta, q, q + delta])
+                else:
+                    low, mid, high = _weighted_quantiles(numeric[col], weights, [q - delta, q, q + delta])
+                values[col], errors[col] = mid, max(high - mid, mid - low)
+            label = f"{q:.0%}"
+            columns[label] = pd.Series(values)
+            columns[f"{label}_err"] = pd.Series(errors)
+        return pd.DataFrame(columns)
+
+    def _publish(self, stage: int, sample: pd.DataFrame, weights: np.ndarray, exact: bool) -> None:
+        z = _z(self.confidence)
+        population = self.sampler.population if self.sampler is not None else self.population
+        keys = [sample[c] for c in self.strata] or [pd.Series(0, index=sample.index)]
+
+        numeric = sample[self.numeric_cols]
+        if exact:
+            mean, mean_se = numeric.mean(), numeric.mean() * 0.0
+            std = numeric.std()
+        else:
+            mean, mean_se = _stratified_mean(numeric, weights, keys, population)
+            centered = (numeric - mean) ** 2
+            std = np.sqrt((centered.fillna(0) * weights[:, None]).sum()
+                          / (numeric.notna() * weights[:, None]).sum())
+
+        if self._seen and not exact:
+            low, high = self._min, self._max
+        else:
+            low, high = numeric.min(), numeric.max()
+        summary = pd.DataFrame({"mean": mean, "mean_err": z * mean_se, "std": std,
+                                "min": low, "max": high})
+        summary = summary.join(self._quantiles(numeric, weights, exact))
+
+        corr = numeric.corr()
+        if exact:
+            corr_low = corr_high = corr
+        else:
+            # Fisher z-transform interval
+            fisher = np.arctanh(corr.clip(-0.999999, 0.999999))
+            half = z / np.sqrt(max(len(sample) - 3, 1))
+            corr_low, corr_high = np.tanh(fisher - half), np.tanh(fisher + half)
+
+        nulls = sample.isnull().astype(np.float64)
+        if exact:
+            missing_frac, missing_se = nulls.mean(), nulls.mean() * 0.0
+        else:
+            missing_frac, missing_se = _stratified_mean(nulls, weights, keys, population)
+        missing = pd.DataFrame({"missing_pct": 100 * missing_frac,
+                                "missing_pct_err": 100 * z * missing_se})
+
+        distinct = sample.nunique() if exact else None
+
+        estimate = Estimate(
+            stage=stage, rows=len(sample), population=population, exact=exact,
+            confidence=self.confidence, summary=summary, corr=corr,
+            corr_low=corr_low, corr_high=corr_high, missing=missing,
+            distinct=distinct, sample=sample,
+            weights=weights, strata=self.strata,
+        )
+        with self._lock:
+            self._latest = estimate
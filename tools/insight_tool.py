@@ -3,17 +3,13 @@
 from langchain.tools import Tool
 import pandas as pd
 from data_loader import load_snapshots
-import os
-from dotenv import load_dotenv
-import google.generativeai as genai
 import io
 import base64
 from PIL import Image as PILImage
+from llm_gateway import get_gateway
+from prompts import PromptTemplates
 
-load_dotenv()
-
-# Configure Gemini
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
 
 # Persistent context of last visualization (shared across tools)
 last_chart_summary = ""
@@ -29,9 +25,6 @@ def analyze_chart_with_gemini(query, df, figure=None):
         except ImportError:
             figure = None
     
-    # Initialize Gemini model
-    model = genai.GenerativeModel('gemini-2.0-flash-exp')
-    
     if figure is not None:
         # Convert matplotlib figure to PIL Image
         buffer = io.BytesIO()
@@ -39,16 +32,15 @@ def analyze_chart_with_gemini(query, df, figure=None):
         buffer.seek(0)
         pil_image = PILImage.open(buffer)
         
-        # Create prompt for vision analysis
+        # Create prompt for vision analysis. Static instructions and dataset
+        # context come first and the chart and query go last, keeping the
+        # prompt layout the same as the Anthropic tools.
         vision_prompt = f"""
-You are a senior data analyst. Analyze this visualization and provide detailed insights.
-
-User Query: "{query}"
+You are a senior data analyst. Analyze the visualization that follows and provide detailed insights
+for the user query given after it.
 
 Dataset Context:
-- Shape: {df.shape}
-- Columns: {list(df.columns)}
-- Sample data: {df.head(2).to_string()}
+{PromptTemplates.get_dataset_schema(df)}
 
 Please provide:
 1. **Chart Description**: What type of visualization is this and what does it show?
@@ -62,7 +54,10 @@ Be specific about what you see in the chart - mention actual values, trends, out
         
         try:
             # Send image and prompt to Gemini
-            response = model.generate_content([vision_prompt, pil_image])
+            response = get_gateway().complete(
+                "gemini", model=GEMINI_MODEL,
+                contents=[vision_prompt, pil_image, f'User Query: "{query}"']
+            )
             return response.text
             
         except Exception as e:
@@ -71,12 +66,10 @@ Be specific about what you see in the chart - mention actual values, trends, out
     else:
         # Fallback to text-only analysis if no figure available
         text_prompt = f"""
-You are a senior data analyst. A user asked: "{query}"
+You are a senior data analyst. Answer the user question given at the end.
 
 Dataset Information:
-- Shape: {df.shape}
-- Columns: {list(df.columns)}
-- Sample data: {df.head(3).to_string()}
+{PromptTemplates.get_dataset_schema(df)}
 
 Provide comprehensive insights about this dataset focusing on:
 - Key patterns and relationships
@@ -88,7 +81,9 @@ Be specific and detailed in your analysis.
 """
         
         try:
-            response = model.generate_content(text_prompt)
+            response = get_gateway().complete(
+                "gemini", model=GEMINI_MODEL, contents=[text_prompt, f'A user asked: "{query}"']
+            )
             return response.text
             
         except Exception as e:
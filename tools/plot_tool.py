@@ -1,5 +1,4 @@
 from langchain.tools import Tool
-from anthropic import Anthropic
 import pandas as pd
 from data_loader import load_snapshots
 import matplotlib
@@ -8,50 +7,59 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import io
 import os
-from dotenv import load_dotenv
+import threading
+from llm_gateway import get_gateway
+from prompts import PromptTemplates
 
-load_dotenv()
+MODEL_SETTINGS = {"model": "claude-3-5-sonnet-20241022", "temperature": 0.1, "max_tokens": 3096}
 
-api_key = os.getenv("ANTHROPIC_API_KEY")    
-client = Anthropic(api_key=api_key)
+# Last generated figure/query, kept per thread so concurrent sessions
+# (e.g. batch workers) don't read each other's charts
+_state = threading.local()
 
-# Global variable to store the last generated figure
-_last_figure = None
-_last_query = ""
+# Generated code keyed by (normalized query, columns); shared by all sessions
+_code_cache = {}
+_code_cache_lock = threading.Lock()
 
-def generate_and_run_code(query, df):
-    global _last_figure, _last_query
-    code = ""  # ensure code is defined even if prompt fails
+# pyplot keeps global figure state, so rendering is serialized
+_render_lock = threading.Lock()
 
-    prompt = f"""
-You are a Python data analyst. A user asked: "{query}"
+def _cache_key(query, df):
+    return (" ".join(query.lower().split()), tuple(df.columns))
 
-Here is the first 3 rows of the DataFrame `df`:
-{df.head(3).to_string()}
+def generate_and_run_code(query, df):
+    code = ""  # ensure code is defined even if prompt fails
 
-Write Python code (only code, no explanation) that:
-- Uses pandas, seaborn, or matplotlib
-- Assumes df is already loaded
-- Always begins with: fig = plt.figure(figsize=(10,6))
-- Draws plots into that figure
-- Ends with: return fig (do NOT use plt.show())
-- Handles missing values and categorical axes if needed
-- Do NOT include any explanation or markdown formatting. Only return raw, executable Python code. No text before or after.  
-"""
+    # Codegen instructions and the dataset schema form a stable prefix that
+    # Anthropic caches; only the user's request changes between calls
+    system = [
+        {"type": "text", "text": PromptTemplates.CODEGEN_INSTRUCTIONS},
+        {
+            "type": "text",
+            "text": PromptTemplates.get_dataset_schema(df),
+            "cache_control": {"type": "ephemeral"},
+        },
+    ]
+    prompt = f'A user asked: "{query}"'
 
     try:
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            temperature=0.1,
-            max_tokens=3096,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        key = _cache_key(query, df)
+        with _code_cache_lock:
+            code = _code_cache.get(key, "")
 
-        code = response.content[0].text.strip()
+        if not code:
+            response = get_gateway().complete(
+                "anthropic",
+                system=system,
+                messages=[{"role": "user", "content": prompt}],
+                **MODEL_SETTINGS
+            )
 
-        # Clean backticks if present
-        if code.startswith("```"):
-            code = code.replace("```python", "").replace("```", "").strip()
+            code = response.text.strip()
+
+            # Clean backticks if present
+            if code.startswith("```"):
+                code = code.replace("```python", "").replace("```", "").strip()
 
         exec_globals = {
             "df": df,
@@ -64,12 +72,17 @@ Write Python code (only code, no explanation) that:
         # Wrap the code in a function for better scoping
         wrapped_code = "def execute_code():\n    " + "\n    ".join(code.splitlines()) + "\n    return fig"
         local_vars = {}
-        exec(wrapped_code, exec_globals, local_vars)
-        fig = local_vars["execute_code"]()
-        
-        # Store the figure globally so we can access it later
-        _last_figure = fig
-        _last_query = query
+        with _render_lock:
+            exec(wrapped_code, exec_globals, local_vars)
+            fig = local_vars["execute_code"]()
+
+        # Only cache code that actually rendered
+        with _code_cache_lock:
+            _code_cache[key] = code
+
+        # Store the figure for this thread so we can access it later
+        _state.last_figure = fig
+        _state.last_query = query
         
         # Set context for insight tool
         try:
@@ -86,13 +99,23 @@ Write Python code (only code, no explanation) that:
 
 def get_last_figure():
     """Get the last generated figure"""
-    global _last_figure
-    return _last_figure
+    return getattr(_state, "last_figure", None)
 
 def get_last_query():
     """Get the last visualization query"""
-    global _last_query
-    return _last_query
+    return getattr(_state, "last_query", "")
+
+def close_figure(fig, path=None):
+    """Optionally save a figure to ``path``, then close it, under the render lock"""
+    with _render_lock:
+        if path is not None:
+            fig.savefig(path, dpi=150, bbox_inches="tight")
+        plt.close(fig)
+
+def clear_last_figure():
+    """Forget the last figure for the current thread"""
+    _state.last_figure = None
+    _state.last_query = ""
 
 # Define the LangChain Tool
 dynamic_python_tool = Tool.from_function(
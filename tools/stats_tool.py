@@ -2,12 +2,44 @@ import pandas as pd
 import numpy as np
 from typing import Dict, Any, List, Optional
 import logging
+import threading
+
+from langchain.tools import Tool
+from config import Config
+from data_loader import SnapshotLoader
+from tools.approx_stats import (
+    DEFAULT_MIN_ROWS, DEFAULT_SAMPLE_ROWS, DEFAULT_STRATA, ProgressiveStats, stratified_sample_sql
+)
 
 logger = logging.getLogger(__name__)
 
 class StatsTool:
-    def __init__(self, data_loader):
+    def __init__(self, data_loader, approximate: bool = False,
+                 approx_min_rows: int = DEFAULT_MIN_ROWS,
+                 approx_sample_rows: int = DEFAULT_SAMPLE_ROWS, strata=DEFAULT_STRATA):
+        """
+        Args:
+            data_loader: Object exposing ``query(sql) -> DataFrame``
+            approximate: Answer from a stratified sample on large tables and
+                refine in the background (see ``tools.approx_stats``)
+            approx_min_rows: Tables smaller than this are always answered exactly
+            approx_sample_rows: Size of the first (SQL-drawn) sample
+            strata: Columns used to stratify the sample
+        """
         self.data_loader = data_loader
+        self.approximate = approximate
+        self.approx_min_rows = approx_min_rows
+        self.approx_sample_rows = approx_sample_rows
+        self.strata = strata
+        self._progressive = None
+        self._progressive_key = None
+        # Serializes creating/replacing the progressive estimate, so concurrent
+        # callers (agent and prefetcher) share one sample and one full load
+        self._progressive_lock = threading.Lock()
+        # Exact results keyed by analysis and dataset shape, shared by the
+        # agent and the background prefetcher
+        self._cache = {}
+        self._cache_lock = threading.Lock()
     
     def run(self, query: str) -> str:
         """
@@ -20,6 +52,15 @@ class StatsTool:
             str: Formatted statistical summary
         """
         try:
+            query = query.lower()
+            
+            # Large tables are answered from a sample without loading them
+            if self.approximate:
+                population = int(self.data_loader.query("SELECT COUNT(*) AS n FROM dataset")["n"].iloc[0])
+                if population >= self.approx_min_rows:
+                    columns = list(self.data_loader.query("SELECT * FROM dataset LIMIT 0").columns)
+                    return self._run_approximate(query, population, columns)
+            
             # Get the data
             df = self.data_loader.query("SELECT * FROM dataset")
             
@@ -27,24 +68,182 @@ class StatsTool:
                 return "No data available for analysis. Please load a dataset first."
             
             # Check for specific analysis requests
-            query = query.lower()
+            group_col = self._find_column(query, df.columns, " by ")
+            target_col = self._find_column(query, df.columns, " with ")
+            
+            key = (self._classify(query, group_col, target_col), group_col, target_col,
+                   df.shape, tuple(df.columns))
+            with self._cache_lock:
+                if key in self._cache:
+                    return self._cache[key]
             
-            if "overview" in query or "summary" in query:
-                return self._get_data_overview(df)
-            elif "missing" in query or "null" in query:
-                return self._get_missing_data_summary(df)
-            elif "correlation" in query:
-                return self._get_correlation_analysis(df)
-            elif "describe" in query:
-                return self._get_descriptive_statistics(df)
+            kind = key[0]
+            if kind == "overview":
+                result = self._get_data_overview(df)
+            elif kind == "missing":
+                result = self._get_missing_data_summary(df)
+            elif kind == "target_correlation":
+                result = self._get_target_correlation(df, target_col)
+            elif kind == "correlation":
+                result = self._get_correlation_analysis(df)
+            elif kind == "describe":
+                result = self._get_descriptive_statistics(df)
+            elif kind == "group":
+                result = self._get_group_summary(df, group_col)
             else:
                 # Default to general statistics
-                return self._get_general_statistics(df)
+                result = self._get_general_statistics(df)
+            
+            with self._cache_lock:
+                self._cache[key] = result
+            return result
                 
         except Exception as e:
             logger.error(f"Error generating statistics: {str(e)}")
             return f"I encountered an error while analyzing the data: {str(e)}"
     
+    def clear_cache(self):
+        """Forget cached results, e.g. after the underlying data changed."""
+        with self._cache_lock:
+            self._cache.clear()
+    
+    def _classify(self, query: str, group_col: Optional[str], target_col: Optional[str]) -> str:
+        """Map a query to the analysis that answers it."""
+        if "overview" in query or "summary" in query:
+            return "overview"
+        elif "missing" in query or "null" in query:
+            return "missing"
+        elif "correlation" in query:
+            return "target_correlation" if target_col else "correlation"
+        elif "describe" in query:
+            return "describe"
+        elif group_col:
+            return "group"
+        return "general"
+    
+    def _find_column(self, query: str, columns, keyword: str) -> Optional[str]:
+        """Return the column named after ``keyword`` in the query (e.g. "mean by label")."""
+        if keyword not in query:
+            return None
+        tail = query.split(keyword, 1)[1]
+        for col in sorted(columns, key=len, reverse=True):
+            if str(col).lower() in tail:
+                return col
+        return None
+    
+    def _get_group_summary(self, df: pd.DataFrame, group_col: str) -> str:
+        """Generate mean of numeric columns per group."""
+        numeric_cols = [c for c in df.select_dtypes(include=[np.number]).columns if c != group_col]
+        means = df.groupby(group_col, dropna=False)[numeric_cols].mean()
+        return f"Mean by {group_col}:\n{means.T.to_string(float_format=lambda v: f'{v:.2f}')}"
+    
+    def _run_approximate(self, query: str, population: int, columns: List[str]) -> str:
+        """Answer from the most refined progressive estimate available.
+        
+        The first estimate uses a stratified sample drawn in SQL; only the
+        background refinement loads the full table, once per table.
+        """
+        group_col = self._find_column(query, columns, " by ")
+        target_col = self._find_column(query, columns, " with ")
+        
+        key = (population, tuple(columns))
+        with self._progressive_lock:
+            if self._progressive is None or self._progressive_key != key:
+                if self._progressive is not None:
+                    self._progressive.cancel()
+                strata = [col for col in self.strata if col in columns]
+                sample = self.data_loader.query(
+                    stratified_sample_sql("dataset", strata, population, self.approx_sample_rows)
+                )
+                weights = sample.pop("_weight").to_numpy(dtype=np.float64)
+                self._progressive = ProgressiveStats(
+                    sample, weights, population,
+                    load_full=lambda: self.data_loader.query("SELECT * FROM dataset"),
+                    strata=strata
+                )
+                self._progressive_key = key
+            progressive = self._progressive
+        estimate = progressive.latest
+        
+        if estimate.exact:
+            header = f"Exact results over all {estimate.population:,} rows."
+        else:
+            strata = ", ".join(estimate.strata) or "none"
+            header = (f"Approximate results from a {estimate.rows:,} of {estimate.population:,} "
+                      f"row sample (stratified by {strata}), ± {estimate.confidence:.0%} "
+                      f"confidence intervals. Ask again for a refined answer.")
+        
+        if "missing" in query or "null" in query:
+            body = self._format_approx_missing(estimate)
+        elif "correlation" in query:
+            body = self._format_approx_correlation(estimate, target_col)
+        elif group_col:
+            body = self._format_approx_groups(estimate, group_col)
+        else:
+            body = self._format_approx_summary(estimate)
+        return f"{header}\n\n{body}"
+    
+    def _format_approx_summary(self, estimate) -> str:
+        """Format approximate per-column statistics."""
+        lines = ["Numeric Columns Summary:"]
+        for col, stats in estimate.summary.iterrows():
+            lines.append(f"{col}:")
+            lines.append(f"  Mean: {stats['mean']:.2f} ± {stats['mean_err']:.2f}")
+            lines.append(f"  Min: {stats['min']:.2f}")
+            lines.append(f"  25%: {stats['25%']:.2f} ± {stats['25%_err']:.2f}")
+            lines.append(f"  Median: {stats['50%']:.2f} ± {stats['50%_err']:.2f}")
+            lines.append(f"  75%: {stats['75%']:.2f} ± {stats['75%_err']:.2f}")
+            lines.append(f"  Max: {stats['max']:.2f}")
+            lines.append(f"  Std Dev: {stats['std']:.2f}")
+            lines.append("")
+        
+        if estimate.distinct is None:
+            lines.append("Distinct values: reported once refinement has scanned the whole table.")
+        else:
+            lines.append("Distinct values:")
+            for col, count in estimate.distinct.items():
+                lines.append(f"- {col}: {count:,}")
+        return "\n".join(lines)
+    
+    def _format_approx_missing(self, estimate) -> str:
+        """Format approximate missing-value percentages."""
+        missing = estimate.missing[estimate.missing["missing_pct"] > 0]
+        if missing.empty:
+            return "No missing values found in the sample."
+        lines = ["Missing Data Summary:", "-" * 60]
+        for col, row in missing.iterrows():
+            lines.append(f"{col:<30} {row['missing_pct']:.1f}% ± {row['missing_pct_err']:.1f}%")
+        return "\n".join(lines)
+    
+    def _format_approx_correlation(self, estimate, target_col: Optional[str] = None) -> str:
+        """Format top correlations with Fisher-z confidence intervals."""
+        corr = estimate.corr
+        pairs = []
+        for i in range(len(corr.columns)):
+            for j in range(i):
+                pairs.append((corr.columns[i], corr.columns[j], corr.iloc[i, j]))
+        pairs = [p for p in pairs if pd.notna(p[2])]
+        if target_col in corr.columns:
+            pairs = [p for p in pairs if target_col in (p[0], p[1])]
+        pairs.sort(key=lambda x: abs(x[2]), reverse=True)
+        
+        lines = ["Top Correlations:", "-" * 60]
+        for col1, col2, value in pairs[:10]:
+            low = estimate.corr_low.loc[col1, col2]
+            high = estimate.corr_high.loc[col1, col2]
+            lines.append(f"{col1} & {col2:<30} {value:.3f} [{low:.3f}, {high:.3f}]")
+        return "\n".join(lines)
+    
+    def _format_approx_groups(self, estimate, group_col: str) -> str:
+        """Format approximate group means."""
+        groups = estimate.group_means(group_col)
+        lines = [f"Mean by {group_col}:"]
+        for key, row in groups.iterrows():
+            lines.append(f"{group_col} = {key}:")
+            for col in [c for c in groups.columns if not c.endswith("_err")]:
+                lines.append(f"  {col}: {row[col]:.2f} ± {row[col + '_err']:.2f}")
+        return "\n".join(lines)
+    
     def _get_data_overview(self, df: pd.DataFrame) -> str:
         """Generate a general overview of the dataset."""
         overview = []
@@ -136,6 +335,20 @@ class StatsTool:
         
         return "\n".join(summary)
     
+    def _get_target_correlation(self, df: pd.DataFrame, target_col: str) -> str:
+        """Generate correlations of every numeric column with one target column."""
+        numeric_cols = df.select_dtypes(include=[np.number]).columns
+        if target_col not in numeric_cols:
+            return f"Column '{target_col}' is not numeric, so correlations can't be computed."
+        
+        corr = df[numeric_cols].corrwith(df[target_col]).drop(target_col).dropna()
+        corr = corr.reindex(corr.abs().sort_values(ascending=False).index)
+        
+        summary = [f"Correlations with {target_col}:", "-" * 60]
+        for col, value in corr.items():
+            summary.append(f"{col:<40} {value:.3f}")
+        return "\n".join(summary)
+    
     def _get_descriptive_statistics(self, df: pd.DataFrame) -> str:
         """Generate detailed descriptive statistics."""
         return str(df.describe(include='all'))
@@ -168,3 +381,22 @@ class StatsTool:
         stats.append(f"- Memory usage: {df.memory_usage(deep=True).sum() / (1024*1024):.2f} MB")
         
         return "\n".join(stats)
+
+# Shared instance so cached results serve both the agent and the prefetcher
+dataset_stats = StatsTool(
+    SnapshotLoader(),
+    approximate=Config.APPROX_STATS,
+    approx_min_rows=Config.APPROX_MIN_ROWS,
+    approx_sample_rows=Config.APPROX_SAMPLE_ROWS
+)
+
+# Define the LangChain Tool
+stats_tool = Tool.from_function(
+    name="DatasetStatistics",
+    func=dataset_stats.run,
+    description=(
+        "Use this tool for numeric answers about the dataset without a chart: "
+        "'overview', 'missing values', 'correlation' or 'correlation with <column>', "
+        "'describe', or 'mean by <column>'."
+    )
+)